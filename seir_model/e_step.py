@@ -27,7 +27,10 @@ def compute_S(s0, t_end, B):
 
     can be simplified to S(t+1) = s0 - sum(B[:t])
     """
-    return s0 - np.concatenate(([0], np.cumsum(B)[:-1]))
+    out = np.empty(len(B), dtype=np.result_type(s0, B))
+    out[0] = 0
+    np.cumsum(B[:-1], out=out[1:])
+    return np.subtract(s0, out, out=out)
 
 
 def compute_E(e0, t_end, B, C):
@@ -37,7 +40,22 @@ def compute_E(e0, t_end, B, C):
 
     can be simplified to E(t+1) = e0+sum(B[:t]-C[:t])
     """
-    return e0 + np.concatenate(([0], np.cumsum(B - C)[:-1]))
+    out = np.empty(len(B), dtype=np.result_type(e0, B, C))
+    out[0] = 0
+    np.subtract(B[:-1], C[:-1], out=out[1:])
+    np.cumsum(out[1:], out=out[1:])
+    out += e0
+    return out
+
+
+def floored_binom_loglik(k, n, p, epsilon):
+    """
+    sum of log(Binom(k; n, p) + epsilon)
+
+    the pmf is floored at epsilon to prevent log 0, so impossible k keep a
+    finite log likelihood. logaddexp(logpmf, log(epsilon)) = log(pmf + epsilon)
+    """
+    return np.sum(np.logaddexp(sp.stats.binom.logpmf(k, n, p), np.log(epsilon)))
 
 
 def metropolis_hastings(x, fn, proposal, conditions_fn, burn_in=1, interval=1, num_samples=1):
@@ -81,8 +99,7 @@ def update_data(variables, inits, params, t_end, t_ctrl, m, epsilon):
         S, E = data
         # assert (S >= x).all()
         # assert (x >= 0).all()
-        # add epsilon to prevent log 0.
-        return np.sum(np.log(sp.stats.binom(S, P).pmf(B)+epsilon))
+        return floored_binom_loglik(B, S, P, epsilon)
         
 
     def proposal(x, data, conditions_fn):
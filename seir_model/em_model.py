@@ -7,7 +7,7 @@ import matplotlib.pyplot as plt
 import warnings
 import time
 
-from e_step import update_data, compute_S, compute_E
+from e_step import update_data, compute_S, compute_E, floored_binom_loglik
 
 np.seterr(all='ignore')
 warnings.filterwarnings('ignore')
@@ -163,11 +163,10 @@ def update_params(B, C, D, P, I, S, E, inits, params, N, t_end, t_ctrl, epsilon,
         pR = 1 - np.exp(-gamma)
         P = compute_P(transmission_rate(beta, q, t_ctrl, t_end), I, N, l)
 
-        # log likelihood
-        # add epsilon to avoid log 0.
-        logB = np.sum(np.log(sp.stats.binom(S, P).pmf(B) + epsilon))
-        logC = np.sum(np.log(sp.stats.binom(E, pC).pmf(C) + epsilon))
-        logD = np.sum(np.log(sp.stats.binom(I, pR).pmf(D) + epsilon))
+        # log likelihood. SLSQP needs a finite objective, so it is floored at epsilon
+        logB = floored_binom_loglik(B, S, P, epsilon)
+        logC = floored_binom_loglik(C, E, pC, epsilon)
+        logD = floored_binom_loglik(D, I, pR, epsilon)
 
         # assert not np.isnan(logB)
         # assert not np.isnan(logC)
@@ -191,7 +190,12 @@ def compute_I(i0, t_end, C, D):
 
     can be simplified to I(t+1) = i0+sum(C[:t]-D[:t])
     """
-    return i0 + np.concatenate(([0], np.cumsum(C - D)[:-1]))
+    out = np.empty(len(C), dtype=np.result_type(i0, C, D))
+    out[0] = 0
+    np.subtract(C[:-1], D[:-1], out=out[1:])
+    np.cumsum(out[1:], out=out[1:])
+    out += i0
+    return out
 
 def transmission_rate(beta, q, t_ctrl, t_end):
     """
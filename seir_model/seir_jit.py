@@ -0,0 +1,324 @@
+import math
+import numpy as np
+from numba import njit
+
+"""
+Compiled kernels for the SEIR model. The MCMC samplers in seir_model.py
+call these on short (t_end ~ 60) arrays many times per iteration, so they
+are written as plain scalar loops under numba instead of numpy/scipy calls
+to avoid python object overhead.
+"""
+
+
+@njit(cache=True)
+def compute_S(e0, i_mild0, i_wild0, B, N, out=None):
+    """
+    S(0) = s0
+    S(t+1) = S(t) - B(t) + N(t+1)-N(t) for t >= 0
+
+    can be simplified to S(t+1) = N(t+1) - sum(B[:t])
+    the result is written to out if it is given
+    """
+    if out is None:
+        S = np.empty_like(N)
+    else:
+        S = out
+    acc = 0
+    for t in range(len(N)):
+        S[t] = N[t] - acc
+        acc += B[t]
+    return S
+
+
+@njit(cache=True)
+def compute_E(e0, B, C, out=None):
+    """
+    E(0) = e0
+    E(t+1) = E(t) + B(t) - C(t) for t >= 0
+
+    can be simplified to E(t+1) = e0+sum(B[:t]-C[:t])
+    the result is written to out if it is given
+    """
+    if out is None:
+        E = np.empty_like(B)
+    else:
+        E = out
+    acc = e0
+    for t in range(len(B)):
+        E[t] = acc
+        acc += B[t] - C[t]
+    return E
+
+
+@njit(cache=True)
+def compute_I(i0, C, D, out=None):
+    """
+    computes either I_mild or I_wild depending on the inputs
+    I(0) = i0
+    I(t+1) = I(t) + C(t) - D(t) for t >= 0
+
+    can be simplified to I(t+1) = i0+sum(C[:t]-D[:t])
+    the result is written to out if it is given
+    """
+    if out is None:
+        I = np.empty_like(C)
+    else:
+        I = out
+    acc = i0
+    for t in range(len(C)):
+        I[t] = acc
+        acc += C[t] - D[t]
+    return I
+
+
+@njit(cache=True)
+def transmission_rate(beta, q, t_ctrl, t_end, out=None):
+    """
+    rate of transmission on day t, ie. the number of
+    newly infected individuals on day t.
+
+    This is defined to be beta prior to t_ctrl and beta*exp(-q(t-t_ctrl)) after t_ctrl
+    the result is written to out if it is given
+
+    Note: this is different from R0
+    """
+    if out is None:
+        trans_rate = np.empty(t_end)
+    else:
+        trans_rate = out
+    for t in range(t_end):
+        if t < t_ctrl:
+            trans_rate[t] = beta
+        else:
+            trans_rate[t] = beta * math.exp(-q * (t - t_ctrl))
+    return trans_rate
+
+
+@njit(cache=True)
+def compute_P(trans_rate, I_mild, I_wild, N, out=None):
+    """
+    P[t] = 1 - exp(-BETA[t] * I[t] / N)
+    here BETA[t] = time dependent transmission rate
+    the result is written to out if it is given
+    """
+    if out is None:
+        P = np.empty(len(trans_rate))
+    else:
+        P = out
+    for t in range(len(trans_rate)):
+        P[t] = 1 - math.exp(-trans_rate[t] * (I_mild[t] + I_wild[t]) / N[t])
+    return P
+
+
+@njit(cache=True)
+def binom_logpmf(n, p, k):
+    """
+    log of the binomial pmf Binom(n, p) at k, for scalar n, p, k.
+    returns -inf outside of the support.
+    """
+    coef = 0.
+    if 0 <= k <= n:
+        coef = math.lgamma(n + 1) - math.lgamma(k + 1) - math.lgamma(n - k + 1)
+    return binom_logpmf_coef(coef, n, p, k)
+
+
+@njit(cache=True)
+def binom_logpmf_coef(coef, n, p, k):
+    """
+    same as binom_logpmf, but with the log binomial coefficient
+    coef = lgamma(n+1) - lgamma(k+1) - lgamma(n-k+1) already computed
+    """
+    if k < 0 or k > n or n < 0:
+        return -np.inf
+    if p <= 0:
+        return 0. if k == 0 else -np.inf
+    if p >= 1:
+        return 0. if k == n else -np.inf
+    return coef + k * math.log(p) + (n - k) * math.log1p(-p)
+
+
+@njit(cache=True)
+def log_binom_coef(n, k, out=None):
+    """
+    out[t] = lgamma(n[t]+1) - lgamma(k[t]+1) - lgamma(n[t]-k[t]+1), or 0 where
+    k[t] is outside of [0, n[t]] (binom_logpmf_coef doesn't use it there)
+    the result is written to out if it is given
+    """
+    if out is None:
+        coef = np.empty(len(k))
+    else:
+        coef = out
+    for t in range(len(k)):
+        if k[t] < 0 or k[t] > n[t]:
+            coef[t] = 0.
+        else:
+            coef[t] = math.lgamma(n[t] + 1) - math.lgamma(k[t] + 1) - math.lgamma(n[t] - k[t] + 1)
+    return coef
+
+
+@njit(cache=True)
+def binom_logpmf_lgamma_k(lgamma_k, n, p, k):
+    """
+    same as binom_logpmf, but with lgamma_k = lgamma(k+1) already computed
+    """
+    coef = 0.
+    if 0 <= k <= n:
+        coef = math.lgamma(n + 1) - lgamma_k - math.lgamma(n - k + 1)
+    return binom_logpmf_coef(coef, n, p, k)
+
+
+@njit(cache=True)
+def lgamma_plus_one(k, out=None):
+    """
+    out[t] = lgamma(k[t]+1), the part of the log binomial coefficient that
+    only depends on k. the result is written to out if it is given
+    """
+    if out is None:
+        lg = np.empty(len(k))
+    else:
+        lg = out
+    for t in range(len(k)):
+        lg[t] = math.lgamma(k[t] + 1) if k[t] >= 0 else 0.
+    return lg
+
+
+@njit(cache=True)
+def binom_loglik(n, p, k):
+    """
+    sum_t log(Binom(n[t], p[t]).pmf(k[t]))
+
+    -inf if any k[t] is impossible
+    """
+    acc = 0.
+    for t in range(len(k)):
+        acc += binom_logpmf(n[t], p[t], k[t])
+    return acc
+
+
+@njit(cache=True)
+def binom_loglik_const_p(n, p, k):
+    """
+    same as binom_loglik but with a single p shared by every t
+    """
+    acc = 0.
+    for t in range(len(k)):
+        acc += binom_logpmf(n[t], p, k[t])
+    return acc
+
+
+@njit(cache=True)
+def log_prob_B(B, S, P):
+    """
+    log likelihood of B, where B(t) ~ Binom(S(t), P(t))
+    """
+    return binom_loglik(S, P, B)
+
+
+@njit(cache=True)
+def log_prob_C(C, E, pC):
+    """
+    log likelihood of C, where C(t) ~ Binom(E(t), pC) and pC = 1-exp(-rho)
+    """
+    return binom_loglik_const_p(E, pC, C)
+
+
+@njit(cache=True)
+def log_prob_D_mild(D_mild, I_mild, pR_mild):
+    """
+    log likelihood of D_mild, where D_mild(t) ~ Binom(I_mild(t), pR_mild) and pR_mild = 1-exp(-gamma_mild)
+    """
+    return binom_loglik_const_p(I_mild, pR_mild, D_mild)
+
+
+@njit(cache=True)
+def round_half_even(x):
+    """
+    scalar version of round_int in seir_model.py
+    """
+    return int(np.rint(x))
+
+
+@njit(cache=True)
+def initialize_states(e0, i_mild0, i_wild0, delta, rho, gamma_mild, N, D_wild, t_rate):
+    """
+    deterministic initial values for the SEIR states. every transition is set
+    to its expected value, eg. B(t) = round(S(t)*P(t)).
+
+    returns: S, E, I_mild, I_wild, B, C, D_mild, P. B[-1] is left at 0 and
+             should be sampled by the caller.
+    """
+    t_end = len(N)
+    S = np.empty(t_end, dtype=np.int64)
+    E = np.empty(t_end, dtype=np.int64)
+    I_mild = np.empty(t_end, dtype=np.int64)
+    I_wild = np.empty(t_end, dtype=np.int64)
+    B = np.zeros(t_end, dtype=np.int64)
+    C = np.empty(t_end, dtype=np.int64)
+    D_mild = np.empty(t_end, dtype=np.int64)
+    P = np.empty(t_end)
+    pC = 1 - math.exp(-rho)
+    pR_mild = 1 - math.exp(-gamma_mild)
+
+    S[0], E[0], I_mild[0], I_wild[0] = N[0], e0, i_mild0, i_wild0
+    for t in range(t_end):
+        P[t] = 1 - math.exp(-t_rate[t] * (I_mild[t] + I_wild[t]) / N[t])
+        assert 0 <= P[t] <= 1
+        C[t] = round_half_even(E[t] * pC)
+        if t == t_end - 1:
+            D_mild[t] = int(I_mild[t] * pR_mild)
+            break
+        B[t] = round_half_even(S[t] * P[t])
+        D_mild[t] = round_half_even(I_mild[t] * pR_mild)
+        c_mild = round_half_even(C[t] * delta)
+
+        # b <= s cause binom dist, so s >= 0
+        S[t+1] = S[t] - B[t] + N[t+1] - N[t]
+        E[t+1] = E[t] + B[t] - C[t]
+        I_mild[t+1] = I_mild[t] + c_mild - D_mild[t]
+        I_wild[t+1] = I_wild[t] + C[t] - c_mild - int(D_wild[t])
+        assert I_wild[t+1] >= 0
+    return S, E, I_mild, I_wild, B, C, D_mild, P
+
+
+@njit(cache=True)
+def param_loglik(S, P, B, lgamma_B, E, pC, C, coef_C, I_mild, pR_mild, D_mild, lgamma_D_mild,
+                 I_wild, pR_wild, D_wild, lgamma_D_wild, epsilon):
+    """
+    log likelihood of B, C, D_mild and D_wild given the params, in one pass:
+        B(t) ~ Binom(S(t), P(t))
+        C(t) ~ Binom(E(t), pC)
+        D_mild(t) ~ Binom(I_mild(t), pR_mild)
+        D_wild(t) ~ Binom(I_wild(t), pR_wild)
+    B, C, D_mild, D_wild and E are fixed while the params are sampled, so the
+    parts of the log binomial coefficients that only depend on them are passed
+    in: lgamma_X = lgamma(X+1) and coef_C = log_binom_coef(E, C).
+    -inf if B, C or D_mild is impossible. D_wild is observed data and can exceed
+    I_wild (eg. in korea_april_16), so its terms are floored at log(epsilon)
+    instead
+    """
+    log_eps = math.log(epsilon)
+    acc = 0.
+    for t in range(len(S)):
+        acc += (binom_logpmf_lgamma_k(lgamma_B[t], S[t], P[t], B[t])
+                + binom_logpmf_coef(coef_C[t], E[t], pC, C[t])
+                + binom_logpmf_lgamma_k(lgamma_D_mild[t], I_mild[t], pR_mild, D_mild[t])
+                + max(binom_logpmf_lgamma_k(lgamma_D_wild[t], I_wild[t], pR_wild, D_wild[t]), log_eps))
+    return acc
+
+
+@njit(cache=True)
+def log_gamma_prior(x, a, loc, lgamma_a, epsilon):
+    """
+    sum_i log(Gamma(a[i], loc[i]).pdf(x[i]) + epsilon), where Gamma(a, loc)
+    is the gamma distribution with shape a, location loc and unit scale
+    (what sp.stats.gamma(a, loc) is). lgamma_a is lgamma(a), computed once
+    by the caller
+    """
+    acc = 0.
+    for i in range(len(x)):
+        z = x[i] - loc[i]
+        pdf = 0.
+        if z > 0:
+            pdf = math.exp((a[i] - 1) * math.log(z) - z - lgamma_a[i])
+        acc += math.log(pdf + epsilon)
+    return acc
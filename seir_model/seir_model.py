@@ -1,15 +1,21 @@
 import argparse
 import numpy as np 
-import scipy as sp
 import pandas as pd
 from pandas.plotting import register_matplotlib_converters
 register_matplotlib_converters()
-from scipy import stats, optimize, interpolate
+from scipy import stats, optimize, interpolate, special
 import matplotlib.pyplot as plt
 import matplotlib.dates as mdates
 import os
 import time
+import warnings
 from datetime import datetime
+from dataclasses import dataclass, field
+from joblib import Parallel, delayed
+
+from seir_jit import (compute_S, compute_E, compute_I, compute_P, transmission_rate,
+                      log_prob_B, log_prob_C, log_prob_D_mild, initialize_states,
+                      param_loglik, log_binom_coef, lgamma_plus_one, log_gamma_prior)
 
 """
 The model learns its parameters from C and D. see docstring of train()
@@ -20,8 +26,15 @@ I generated a dummy dataset that was in paper section 3.3. I set
 N=s0=500 instead of 5364500 for speed. see __name__ == __main__:
 """
 
+# after a rejected try, sample_x draws the indices of this many tries at once
+PROPOSAL_BATCH = 16
+
+# check_rep_inv() re-derives every state array, so it only runs every
+# CHECK_EVERY iterations. running python with -O skips it altogether.
+CHECK_EVERY = 20
+
 
-def metropolis_hastings(x, data, fn, proposal, conditions_fn, burn_in=1):
+def metropolis_hastings(x, data, fn, proposal, conditions_fn, ctx):
     """
     get 1 sample from a distribution p(x) ~ k*fn(x) given proposal
     distribution proposal(x) with metropolis hastings algorithm
@@ -31,24 +44,29 @@ def metropolis_hastings(x, data, fn, proposal, conditions_fn, burn_in=1):
           required to compute the functions
         * assumes proposal distribution is symmetric, ie: q(x'|x) = q(x|x')
         * fn returns log prob. for numeric stability
-
-    returns: one sample from p(x) and corresponding data
+        * ctx is the SamplingContext of the chain. it is passed on to fn,
+          proposal and conditions_fn
+        * takes a single step: proposals are written into the spare buffers
+          of ctx (see swap_buffers), which an accepted x then occupies
+        * fn returns -inf for impossible x. an impossible proposal is rejected,
+          and so is every proposal while x itself is impossible
+
+    returns: one sample from p(x), corresponding data, its log prob and the
+             log prob of the initial x
     """
-    old_log_prob = fn(x, data)
-    while burn_in:
-        burn_in -= 1
-        x_new, data_new = proposal(x, data, conditions_fn)
-        accept_log_prob = min(0, fn(x_new, data_new) - fn(x, data))
-        p = np.log(np.random.uniform(0, 1))
-        if p <= accept_log_prob:
-            x, data = x_new, data_new #, fn(x_new, data_new), fn(x, data)
-        else:
-            pass
-    return x, data, fn(x, data), old_log_prob
+    log_prob = fn(x, data, ctx)
+    x_new, data_new = proposal(x, data, conditions_fn, ctx)
+    log_prob_new = fn(x_new, data_new, ctx)
+    if not (np.isfinite(log_prob) and np.isfinite(log_prob_new)):
+        return x, data, log_prob, log_prob
+    # log(U(0, 1)) <= 0, so there is no need to clip the difference at 0
+    if np.log(ctx.rng.random()) <= log_prob_new - log_prob:
+        return x_new, data_new, log_prob_new, log_prob
+    return x, data, log_prob, log_prob
 
 
 
-def train(N, D_wild, inits, params, priors, rand_walk_stds, t_ctrl, tau, n_iter, n_burn_in, bounds, save_freq):
+def train(N, D_wild, inits, params, priors, rand_walk_stds, t_ctrl, tau, n_iter, n_burn_in, bounds, save_freq, seed=None):
     """
     C = the number of cases by date of symptom onset
     D = the number of cases who are removed (dead or recovered)
@@ -83,8 +101,53 @@ def train(N, D_wild, inits, params, priors, rand_walk_stds, t_ctrl, tau, n_iter,
     m = total number of infected individuals throughout the course of the disease = sum(B)
     
 
+    seed = seed for the np.random.Generator of the chain
+
     returns: the distribution of B and params. They can be used later to calculate R0 and extrapolate
 
+    """
+    C, D_mild, saved_params, saved_R0ts = train_single_chain(seed, N, D_wild, inits, params, priors, rand_walk_stds, 
+                                                             t_ctrl, tau, n_iter, n_burn_in, bounds, save_freq)
+    R0s = compute_R0s(saved_params, D_mild, D_wild)
+    return (C,) + summarize_samples(saved_params, R0s, saved_R0ts)
+
+
+def train_parallel(n_chains, N, D_wild, inits, params, priors, rand_walk_stds, t_ctrl, tau, n_iter, n_burn_in, bounds, 
+                   save_freq, seed=None):
+    """
+    runs n_chains independent chains of train() in parallel processes and pools
+    their samples. every chain gets its own seed spawned from seed.
+
+    running more chains is the way to use more cores. the likelihood sums in
+    seir_jit are not split over threads with numba prange: at t_end ~ 60 starting
+    the threads costs more than the sums, and they would compete with the chains
+    for the same cores.
+
+    returns: the C of every chain, the same summaries as train() computed over
+             all chains, and the Gelman-Rubin R_hat of each param
+    """
+    seeds = np.random.SeedSequence(seed).spawn(n_chains)
+    results = Parallel(n_jobs=n_chains, backend="loky")(
+        delayed(train_single_chain)(chain_seed, N, D_wild, inits, params, priors, rand_walk_stds, 
+                                    t_ctrl, tau, n_iter, n_burn_in, bounds, save_freq)
+        for chain_seed in seeds)
+
+    Cs = np.array([C for C, _, _, _ in results])
+    chain_params = np.array([saved_params for _, _, saved_params, _ in results])
+    # R0 depends on the D_mild of the chain it was sampled in
+    R0s = np.concatenate([compute_R0s(saved_params, D_mild, D_wild) for _, D_mild, saved_params, _ in results])
+    saved_R0ts = np.concatenate([saved_R0ts for _, _, _, saved_R0ts in results])
+    summary = summarize_samples(np.concatenate(chain_params), R0s, saved_R0ts)
+
+    return (Cs,) + summary + (gelman_rubin(chain_params),)
+
+
+def train_single_chain(seed, N, D_wild, inits, params, priors, rand_walk_stds, t_ctrl, tau, n_iter, n_burn_in, bounds, save_freq):
+    """
+    runs one MCMC chain. see train() for the arguments.
+
+    returns: C and D_mild at the end of the chain, and the params and R0[t]
+             saved after burn in
     """
     t_end = len(N)
     assert t_end < tau
@@ -95,48 +158,58 @@ def train(N, D_wild, inits, params, priors, rand_walk_stds, t_ctrl, tau, n_iter,
     # initialize model parameters
     e0, i_mild0, i_wild0 = inits
     beta, q, delta, rho, gamma_mild, gamma_wild, k = params
+    rng = np.random.default_rng(seed)
     print("Initializating Variables...")
-    S, E, I_mild, I_wild, B, C, D_mild, P, t_rate, N = initialize(inits, params, N, D_wild, t_ctrl)
+    S, E, I_mild, I_wild, B, C, D_mild, P, t_rate, N = initialize(inits, params, N, D_wild, t_ctrl, rng)
+    # floor of the prior pdf and of the D_wild likelihood terms, see param_loglik
     epsilon = 1e-16
+    # shape, loc and lgamma(shape) of the gamma prior of each param, see fn_params
+    priors = np.array(priors, dtype=float).T
+    priors = np.vstack((priors, special.gammaln(priors[0])))
+    ctx = SamplingContext(e0, i_mild0, i_wild0, beta, q, delta, rho, gamma_mild, gamma_wild, k,
+                          N, S, E, I_mild, I_wild, B, C, D_mild, D_wild, P, t_rate,
+                          t_ctrl, t_end, epsilon, priors, rand_walk_stds, bounds, rng)
+    ctx.buffers = {'B': np.empty_like(B), 'C': np.empty_like(C), 'D_mild': np.empty_like(D_mild),
+                   'S': np.empty_like(S), 'E': np.empty_like(E), 'I_mild': np.empty_like(I_mild),
+                   'I_wild': np.empty_like(I_wild), 'P': np.empty_like(P), 'N': np.empty_like(N), 
+                   't_rate': np.empty_like(t_rate),
+                   # scratch space for round_int(C*delta) and ctx.param_coefs, never part of the state
+                   'C_mild': np.empty_like(C), 'lgamma_B': np.empty(t_end), 'coef_C': np.empty(t_end),
+                   'lgamma_D_mild': np.empty(t_end)}
     print("Initialization Complete.")
-    check_rep_inv(S, E, I_mild, I_wild, B, C, D_mild, D_wild, P, N, inits, params, t_ctrl, t_end)
+    if __debug__:
+        check_rep_inv(ctx)
 
     # initialize B and params
     print(f"n_burn_in:{n_burn_in}")
     # to show final statistics about params
-    saved_params = []
-    saved_R0ts = []
+    n_saved = sum(1 for i in range(n_burn_in, n_iter) if i % save_freq == 0)
+    saved_params = np.empty((n_saved, len(params)))
+    saved_R0ts = np.empty((n_saved, t_end))
+    n_saved = 0
 
     start_time = time.time()
     t0 = start_time
     t1 = start_time
     for i in range(n_iter):
         # MCMC update for B, S, E
-        beta, q, delta, rho, gamma_mild, gamma_wild, k = params
-
-        B, S, E, log_prob_new, log_prob_old = sample_B(B, [S, E, I_mild, I_wild, C, P, N], inits, params, t_ctrl, epsilon)
-        check_rep_inv(S, E, I_mild, I_wild, B, C, D_mild, D_wild, P, N, inits, params, t_ctrl, t_end)
-        
-        C, E, I_mild, I_wild, P, _, _ = sample_C(C, [E, I_mild, I_wild, D_mild, D_wild, B, N, P], inits, params, t_ctrl, epsilon)
-        check_rep_inv(S, E, I_mild, I_wild, B, C, D_mild, D_wild, P, N, inits, params, t_ctrl, t_end)
-        
-        D_mild, I_mild, P, _, _ = sample_D_mild(D_mild, [I_mild, I_wild, C, N], inits, params, t_ctrl, epsilon)
-        check_rep_inv(S, E, I_mild, I_wild, B, C, D_mild, D_wild, P, N, inits, params, t_ctrl, t_end)
+        log_prob_new, log_prob_old = sample_B(ctx)
+        sample_C(ctx)
+        sample_D_mild(ctx)
         
         # MCMC update for params and P
         # I is fixed by C and D and doesn't need to be updated
-        params, S, E, I_mild, I_wild, P, N, R0t, log_prob_new, log_prob_old = sample_params(params, 
-                                                                    [S, E, I_mild, I_wild, B, C, D_mild, D_wild, P, N], 
-                                                                    inits, priors, rand_walk_stds, t_ctrl, epsilon, bounds
-                                                                   )
-        check_rep_inv(S, E, I_mild, I_wild, B, C, D_mild, D_wild, P, N, inits, params, t_ctrl, t_end)
+        R0t, log_prob_new, log_prob_old = sample_params(ctx)
+        if __debug__ and i % CHECK_EVERY == 0:
+            check_rep_inv(ctx)
         
         if i >= n_burn_in and i % save_freq == 0:
-            saved_params.append(params)
-            saved_R0ts.append(R0t)
+            saved_params[n_saved] = ctx.params
+            saved_R0ts[n_saved] = R0t
+            n_saved += 1
 
         if i % 20 == 0:
-            beta, q, delta, rho, gamma_mild, gamma_wild, k = np.round(params, 5)
+            beta, q, delta, rho, gamma_mild, gamma_wild, k = np.round(ctx.params, 5)
             params_dict = {'beta': beta, 'q': q, 'delta': delta, 'rho': rho,
                            'gamma_mild':gamma_mild, 'gamma_wild':gamma_wild, 'k': k,
                            'log_prob_new':np.round(log_prob_new, 5), 'diff':np.round(log_prob_new-log_prob_old, 5) 
@@ -144,34 +217,157 @@ def train(N, D_wild, inits, params, priors, rand_walk_stds, t_ctrl, tau, n_iter,
             print(f"iter {i}:\n{params_dict}")
             t1 = time.time()
             print("iter %d: Time %.2f | Runtime: %.2f" % (i, t1 - start_time, t1 - t0))
-            print(f"B:\n{B}")
-            print(f"C:\n{C}")
-            print(f"D_mild:\n{D_mild}")
+            print(f"B:\n{ctx.B}")
+            print(f"C:\n{ctx.C}")
+            print(f"D_mild:\n{ctx.D_mild}")
             print(f"D_wild:\n{D_wild}")
             t0 = t1
 
-    R0s = [(sum(D_mild)+sum(D_wild)) * p[0] / (sum(D_mild)*p[3]+sum(D_wild)*p[4]) for p in saved_params]
+    return ctx.C, ctx.D_mild, saved_params, saved_R0ts
+
+
+def compute_R0s(saved_params, D_mild, D_wild):
+    """
+    R0 for each of the saved params
+    """
+    sum_D_mild, sum_D_wild = np.sum(D_mild), np.sum(D_wild)
+    saved_params = np.asarray(saved_params)
+    return (sum_D_mild+sum_D_wild) * saved_params[:, 0] / (sum_D_mild*saved_params[:, 3]+sum_D_wild*saved_params[:, 4])
 
-    # 80% CI
-    CI_FACTOR = 1.96
-    R0_low = np.mean(R0s) - CI_FACTOR * np.std(R0s)
-    R0_high = np.mean(R0s) + CI_FACTOR * np.std(R0s)
+
+def summarize_samples(saved_params, R0s, saved_R0ts):
+    """
+    returns: mean and std of params, the 95% CI of R0 and mean and std of R0[t].
+             all of them are nan if no iteration was saved
+    """
+    if len(R0s) == 0:
+        warnings.warn("no samples were saved, increase n_iter or lower n_burn_in or save_freq")
+        n_params, t_end = saved_params.shape[1], saved_R0ts.shape[1]
+        return (np.full(n_params, np.nan), np.full(n_params, np.nan), (np.nan, np.nan), 
+                (np.full(t_end, np.nan), np.full(t_end, np.nan)))
+
+    # 95% CI from the empirical quantiles, no normality assumption
+    R0_low, R0_high = np.quantile(R0s, [0.025, 0.975])
 
     R0ts_mean = np.mean(saved_R0ts, axis=0)
     R0ts_std = np.std(saved_R0ts, axis=0)
     
-    return C, np.mean(saved_params, axis=0), np.std(saved_params, axis=0), (R0_low, R0_high), (R0ts_mean, R0ts_std)
+    return np.mean(saved_params, axis=0), np.std(saved_params, axis=0), (R0_low, R0_high), (R0ts_mean, R0ts_std)
+
+
+def gelman_rubin(chains):
+    """
+    potential scale reduction factor R_hat of each param. values close to 1
+    suggest that the chains have converged.
+    chains: array of shape (n_chains, n_samples, n_params)
+
+    returns None if R_hat is undefined: with less than 2 chains or 2 samples
+    per chain, or if some param didn't move within the chains
+    """
+    n_chains, n = chains.shape[:2]
+    if n_chains < 2 or n < 2:
+        warnings.warn(f"R_hat needs at least 2 chains with 2 saved samples each, got {n_chains} chains "
+                      f"with {n} samples")
+        return None
+    W = np.mean(np.var(chains, axis=1, ddof=1), axis=0)
+    if not (W > 0).all():
+        warnings.warn(f"R_hat is undefined, params {np.flatnonzero(W == 0).tolist()} have zero variance "
+                      "within every chain")
+        return None
+    B = n * np.var(np.mean(chains, axis=1), axis=0, ddof=1)
+    var_hat = (n-1)/n * W + B/n
+    return np.sqrt(var_hat / W)
+
+
+def round_int(x, out=None):
+    """
+    round to the nearest integer, ties to even. the result is written to the
+    int64 array out if it is given
+    """
+    if out is None:
+        return np.rint(x).astype(np.int64)
+    return np.rint(x, out=out, casting='unsafe')
+
+@dataclass
+class SamplingContext:
+    """
+    state of one MCMC chain. the samplers below read everything they need
+    from it, and sample_B, sample_C, sample_D_mild and sample_params update
+    it in place with the new sample.
+    """
+    e0: int
+    i_mild0: int
+    i_wild0: int
+    beta: float
+    q: float
+    delta: float
+    rho: float
+    gamma_mild: float
+    gamma_wild: float
+    k: float
+    N: np.ndarray
+    S: np.ndarray
+    E: np.ndarray
+    I_mild: np.ndarray
+    I_wild: np.ndarray
+    B: np.ndarray
+    C: np.ndarray
+    D_mild: np.ndarray
+    D_wild: np.ndarray
+    P: np.ndarray
+    t_rate: np.ndarray
+    t_ctrl: int
+    t_end: int
+    epsilon: float
+    priors: np.ndarray
+    rand_walk_stds: list
+    bounds: list
+    rng: np.random.Generator
+    # spare arrays that the samplers write their proposals into. see swap_buffers
+    buffers: dict = field(default_factory=dict)
+    # round_int(C*delta) while sampling D_mild. lives in buffers['C_mild']
+    C_mild: np.ndarray = None
+    # per day transition probabilities 1-exp(-rho), 1-exp(-gamma_mild) and 1-exp(-gamma_wild).
+    # kept in sync with the params by set_params
+    pC: float = None
+    pR_mild: float = None
+    pR_wild: float = None
+    # lgamma(B+1), log_binom_coef(E, C) and lgamma(D_mild+1). these don't change while
+    # sampling the params, so sample_params computes them once for fn_params
+    param_coefs: tuple = None
+    # lgamma(D_wild+1), D_wild is data
+    lgamma_D_wild: np.ndarray = None
+
+    def __post_init__(self):
+        self.set_params(self.params)
+        self.lgamma_D_wild = lgamma_plus_one(self.D_wild)
+
+    @property
+    def params(self):
+        return [self.beta, self.q, self.delta, self.rho, self.gamma_mild, self.gamma_wild, self.k]
+
+    def set_params(self, params, probs=None):
+        """
+        probs is (pC, pR_mild, pR_wild) for params if it is already known
+        """
+        self.beta, self.q, self.delta, self.rho, self.gamma_mild, self.gamma_wild, self.k = params
+        if probs is None:
+            probs = transition_probs(self.rho, self.gamma_mild, self.gamma_wild)
+        self.pC, self.pR_mild, self.pR_wild = probs
 
 
-def round_int(x):
-    return np.floor(x+0.5).astype(int)
+def transition_probs(rho, gamma_mild, gamma_wild):
+    """
+    returns: pC, pR_mild, pR_wild
+    """
+    return 1 - np.exp(-rho), 1 - np.exp(-gamma_mild), 1 - np.exp(-gamma_wild)
 
-def check_rep_inv(S, E, I_mild, I_wild, B, C, D_mild, D_wild, P, N, inits, params, t_ctrl, t_end):
+def check_rep_inv(ctx):
     """
     check rep invariant
     """
-    e0, i_mild0, i_wild0 = inits
-    beta, q, delta, rho, gamma_mild, gamma_wild, k = params
+    S, E, I_mild, I_wild, P, N = ctx.S, ctx.E, ctx.I_mild, ctx.I_wild, ctx.P, ctx.N
+    B, C, D_mild, D_wild = ctx.B, ctx.C, ctx.D_mild, ctx.D_wild
     assert (I_mild >= 0).all()    
     assert (I_wild >= 0).all()  
     assert (S >= 0).all()
@@ -183,13 +379,49 @@ def check_rep_inv(S, E, I_mild, I_wild, B, C, D_mild, D_wild, P, N, inits, param
     assert (D_wild >= 0).all()
     # P is a list of binomial parameters
     assert (1 >= P).all() and (P >= 0).all()
-    assert (S==compute_S(e0, i_mild0, i_wild0, B, N)).all()
-    assert (E==compute_E(e0, B, C)).all()
-    assert (I_mild==compute_I(i_mild0, round_int(C*delta), D_mild)).all()
-    assert (I_wild==compute_I(i_wild0, C-round_int(C*delta), D_wild)).all()
-    assert (P == compute_P(transmission_rate(beta, q, t_ctrl, t_end), I_mild, I_wild, N)).all()
+    assert (S==compute_S(ctx.e0, ctx.i_mild0, ctx.i_wild0, B, N)).all()
+    assert (E==compute_E(ctx.e0, B, C)).all()
+    assert (I_mild==compute_I(ctx.i_mild0, round_int(C*ctx.delta), D_mild)).all()
+    assert (I_wild==compute_I(ctx.i_wild0, C-round_int(C*ctx.delta), D_wild)).all()
+    assert (ctx.t_rate == transmission_rate(ctx.beta, ctx.q, ctx.t_ctrl, ctx.t_end)).all()
+    assert (P == compute_P(ctx.t_rate, I_mild, I_wild, N)).all()
+
+def swap_buffers(buffers, old, new):
+    """
+    proposals are written into the spare arrays in buffers instead of fresh
+    arrays. after an MH step every variable in new is either the old array
+    (rejected) or its buffer (accepted). in the latter case the old array is
+    no longer used and becomes the spare one.
+    old, new: dicts of variable name -> array
+    """
+    for name, arr in new.items():
+        if arr is not old[name]:
+            buffers[name] = old[name]
 
-def sample_x(x, data, conditions_fn, data_fn):
+def draw_tries(rng, nonzero, n, n_changes, n_tries):
+    """
+    yields t_new, t_tilde and one_off for up to n_tries tries of sample_x. t_new
+    are n_changes indices from nonzero and t_tilde n_changes indices from
+    range(n), both without replacement: x_new[t_tilde] += 1 would only add once
+    for duplicates and change sum(x). the indices are changed elementwise, so
+    their order doesn't matter.
+
+    the first try is usually accepted, so it is drawn on its own. the rest are
+    drawn PROPOSAL_BATCH at a time, as the first n_changes of a random
+    permutation of each row
+    """
+    yield (rng.choice(nonzero, n_changes, replace=False, shuffle=False),
+           rng.choice(n, n_changes, replace=False, shuffle=False), rng.integers(0, 2))
+    n_drawn = 1
+    while n_drawn < n_tries:
+        n_batch = min(PROPOSAL_BATCH, n_tries - n_drawn)
+        n_drawn += n_batch
+        T_new = nonzero[np.argsort(rng.random((n_batch, len(nonzero))), axis=1)[:, :n_changes]]
+        T_tilde = np.argsort(rng.random((n_batch, n)), axis=1)[:, :n_changes]
+        one_offs = rng.integers(0, 2, n_batch)
+        yield from zip(T_new, T_tilde, one_offs)
+
+def sample_x(x, data, conditions_fn, data_fn, x_buf, ctx):
     """
     x:  a sample from p(B|.)
     data = [P, I, S, E], and P doesn't depend on x
@@ -203,16 +435,24 @@ def sample_x(x, data, conditions_fn, data_fn):
         6. Verify that E >= 0 (S >= 0 obviously since sum(B) is constant)
         7. Verify I+E>0
     The authors suggested to select N*10% indices instead of 1 for faster convergence
+
+    the proposal is written into x_buf, which must not be x
+
+    this stays in python rather than numba: data_fn and conditions_fn are python
+    callbacks that differ per sampler, and the chain's np.random.Generator can't
+    be passed into njit code. the heavy parts, data_fn's compute_* calls, are
+    compiled kernels
     """
-    n_tries = 0
-    x_new = np.copy(x)
-    while n_tries < 100:
-        n_tries += 1
-        t_new = np.random.choice(np.nonzero(x_new >= 1)[0], min(15, len(np.nonzero(x_new)[0])), replace=False)
-        t_tilde = np.random.choice(range(len(x)), len(t_new), replace=False)
+    rng = ctx.rng
+    x_new = x_buf
+    x_new[:] = x
+    # rejected tries are reverted below, so the nonzero indices of x_new stay
+    # the same for every try
+    nonzero = np.flatnonzero(x_new >= 1)
+    n_changes = min(15, len(nonzero))
+    for t_new, t_tilde, one_off in draw_tries(rng, nonzero, len(x), n_changes, 100):
         # t_new += 1
         assert(x_new[t_new] >= 1).all()
-        one_off = np.random.binomial(1, 0.5)
         if one_off:
             change_add = 1
             change_subs = 1
@@ -220,15 +460,15 @@ def sample_x(x, data, conditions_fn, data_fn):
             # 80 and 79 makes the dist symmetric
             # 79 is the solution 'y' of
             # (n+n/y)-(n+n/y)/80) = n
-            change_add = np.copy(x_new[t_tilde]//79)
-            change_subs = np.copy(x_new[t_new]//80)
+            change_add = x_new[t_tilde]//79
+            change_subs = x_new[t_new]//80
         
         x_new[t_new] -= change_subs
         x_new[t_tilde] += change_add
         
-        data_new = data_fn(x_new)
+        data_new = data_fn(x_new, ctx)
 
-        if conditions_fn(x_new, data_new):
+        if conditions_fn(x_new, data_new, ctx):
             return x_new, data_new
         else:
             # revert back the changes
@@ -238,292 +478,222 @@ def sample_x(x, data, conditions_fn, data_fn):
     # print("no sample found")
     return x, data
 
-def sample_B(B, variables, inits, params, t_ctrl, epsilon):
-    """
-    get a sample from p(B|C, D, params) using metropolis hastings
-    """
-
-    def fn(x, data):
-        S, E = data
-        # add epsilon to prevent log 0.
-        return np.sum(np.log(sp.stats.binom(S, P).pmf(x)+epsilon))
-
-
-    def proposal(x, data, conditions_fn):
-        def data_fn(x):
-            S_new = compute_S(e0, i_mild0, i_wild0, x, N)
-            E_new = compute_E(e0, x, C)
-            return S_new, E_new
-        return sample_x(x, data, conditions_fn, data_fn)
-
+def fn_B(x, data, ctx):
+    S, E = data
+    return log_prob_B(x, S, ctx.P)
 
-    def conditions_fn(x, data):
-        S, E = data
-        # print((S>=0).all())
-        # print((E>=0).all())
-        return  (S>=0).all() and (E>=0).all() #and (E+I_mild+I_wild>0).all()
+def data_fn_B(x, ctx):
+    S_new = compute_S(ctx.e0, ctx.i_mild0, ctx.i_wild0, x, ctx.N, out=ctx.buffers['S'])
+    E_new = compute_E(ctx.e0, x, ctx.C, out=ctx.buffers['E'])
+    return S_new, E_new
 
+def proposal_B(x, data, conditions_fn, ctx):
+    return sample_x(x, data, conditions_fn, data_fn_B, ctx.buffers['B'], ctx)
 
-    t_end = len(B)
-    e0, i_mild0, i_wild0 = inits
-    beta, q, delta, rho, gamma_mild, gamma_wild, k = params
-    S, E, I_mild, I_wild, C, P, N = variables
-    
-    data = [S, E]
-    B, data, log_prob_new, log_prob_old = metropolis_hastings(B, data, fn, proposal, conditions_fn, burn_in=1)
+def conditions_B(x, data, ctx):
     S, E = data
+    return  (S>=0).all() and (E>=0).all() #and (E+I_mild+I_wild>0).all()
 
-    return B, S, E, log_prob_new, log_prob_old
-
-def sample_C(C, variables, inits, params, t_ctrl, epsilon):
+def sample_B(ctx):
     """
     get a sample from p(B|C, D, params) using metropolis hastings
     """
+    data = [ctx.S, ctx.E]
+    old = {'B': ctx.B, 'S': ctx.S, 'E': ctx.E}
+    ctx.B, data, log_prob_new, log_prob_old = metropolis_hastings(ctx.B, data, fn_B, proposal_B, conditions_B, ctx)
+    ctx.S, ctx.E = data
+    swap_buffers(ctx.buffers, old, {'B': ctx.B, 'S': ctx.S, 'E': ctx.E})
 
-    def fn(x, data):
-        E, I_mild, I_wild, P = data
-        # add epsilon to prevent log 0.
-        pC = 1-np.exp(-rho)
-        assert 0 <= pC <= 1
-        return np.sum(np.log(sp.stats.binom(E, pC).pmf(x)+epsilon))
-
-
-    def proposal(x, data, conditions_fn):
-        def data_fn(x):
-            E_new = compute_E(e0, B, x)
-            I_mild_new = compute_I(i_mild0, round_int(delta*x), D_mild)
-            I_wild_new = compute_I(i_wild0, x - round_int(delta*x), D_wild)
-            P_new = compute_P(transmission_rate(beta, q, t_ctrl, t_end), I_mild_new, I_wild_new, N)
-            return E_new, I_mild_new, I_wild_new, P_new
-        return sample_x(x, data, conditions_fn, data_fn)
-
-
-    def conditions_fn(x, data):
-        E, I_mild, I_wild, P = data
-        return  (E>=0).all() and (I_mild>=0).all() and (I_wild>=0).all()# and (E+I_mild+I_wild > 0).all()
+    return log_prob_new, log_prob_old
 
-
-    t_end = len(C)
-    e0, i_mild0, i_wild0 = inits
-    beta, q, delta, rho, gamma_mild, gamma_wild, k = params
-    E, I_mild, I_wild, D_mild, D_wild, B, N, P = variables
-    
-    data = [E, I_mild, I_wild, P]
-    C, data, log_prob_new, log_prob_old = metropolis_hastings(C, data, fn, proposal, conditions_fn, burn_in=1)
+def fn_C(x, data, ctx):
     E, I_mild, I_wild, P = data
+    return log_prob_C(x, E, ctx.pC)
+
+def data_fn_C(x, ctx):
+    # params are fixed while sampling C, so ctx.t_rate is too
+    buffers = ctx.buffers
+    E_new = compute_E(ctx.e0, ctx.B, x, out=buffers['E'])
+    x_mild = round_int(ctx.delta*x, out=buffers['C_mild'])
+    I_mild_new = compute_I(ctx.i_mild0, x_mild, ctx.D_mild, out=buffers['I_mild'])
+    I_wild_new = compute_I(ctx.i_wild0, x - x_mild, ctx.D_wild, out=buffers['I_wild'])
+    P_new = compute_P(ctx.t_rate, I_mild_new, I_wild_new, ctx.N, out=buffers['P'])
+    return E_new, I_mild_new, I_wild_new, P_new
+
+def proposal_C(x, data, conditions_fn, ctx):
+    return sample_x(x, data, conditions_fn, data_fn_C, ctx.buffers['C'], ctx)
+
+def conditions_C(x, data, ctx):
+    E, I_mild, I_wild, P = data
+    return  (E>=0).all() and (I_mild>=0).all() and (I_wild>=0).all()# and (E+I_mild+I_wild > 0).all()
 
-    return C, E, I_mild, I_wild, P, log_prob_new, log_prob_old
-
-def sample_D_mild(D_mild, variables, inits, params, t_ctrl, epsilon):
+def sample_C(ctx):
     """
-    get a sample from p(B|C, D, params) using metropolis hastings
+    get a sample from p(C|B, D, params) using metropolis hastings
     """
+    data = [ctx.E, ctx.I_mild, ctx.I_wild, ctx.P]
+    old = {'C': ctx.C, 'E': ctx.E, 'I_mild': ctx.I_mild, 'I_wild': ctx.I_wild, 'P': ctx.P}
+    ctx.C, data, log_prob_new, log_prob_old = metropolis_hastings(ctx.C, data, fn_C, proposal_C, conditions_C, ctx)
+    ctx.E, ctx.I_mild, ctx.I_wild, ctx.P = data
+    swap_buffers(ctx.buffers, old, {'C': ctx.C, 'E': ctx.E, 'I_mild': ctx.I_mild, 'I_wild': ctx.I_wild, 'P': ctx.P})
 
-    def fn(x, data):
-        I_mild = data[0]
-        # assert (S >= x).all()
-        # assert (x >= 0).all()
-        # add epsilon to prevent log 0.
-        pR = 1-np.exp(-gamma_mild)
-        assert 0 <= pR <= 1
-        assert not np.isnan(pR)
-        return np.sum(np.log(sp.stats.binom(I_mild, pR).pmf(x)+epsilon))
-        
+    return log_prob_new, log_prob_old
 
-    def proposal(x, data, conditions_fn):
-        I_mild = data[0]
-        def data_fn(x):
-            I_mild_new = compute_I(i_mild0, round_int(C*delta), x)
-            return [I_mild_new]
-        
-        return sample_x(x, data, conditions_fn, data_fn)
+def fn_D_mild(x, data, ctx):
+    I_mild = data[0]
+    return log_prob_D_mild(x, I_mild, ctx.pR_mild)
 
-    def conditions_fn(x, data):
-        I_mild = data[0]
-        return (I_mild>=0).all()
+def data_fn_D_mild(x, ctx):
+    I_mild_new = compute_I(ctx.i_mild0, ctx.C_mild, x, out=ctx.buffers['I_mild'])
+    return [I_mild_new]
 
-    t_end = len(D_mild)
-    e0, i_mild0, i_wild0 = inits
-    beta, q, delta, rho, gamma_mild, gamma_wild, k = params
-    I_mild, I_wild, C, N = variables
-    data = [I_mild]
-    D_mild, data, log_prob_new, log_prob_old = metropolis_hastings(D_mild, data, fn, proposal, conditions_fn, burn_in=1)
+def proposal_D_mild(x, data, conditions_fn, ctx):
+    return sample_x(x, data, conditions_fn, data_fn_D_mild, ctx.buffers['D_mild'], ctx)
+
+def conditions_D_mild(x, data, ctx):
     I_mild = data[0]
-    P = compute_P(transmission_rate(beta, q, t_ctrl, t_end), I_mild, I_wild, N)
-    return [D_mild] + data + [P, log_prob_new, log_prob_old]
+    return (I_mild>=0).all()
 
-def sample_params(params, variables, inits, priors, rand_walk_stds, t_ctrl, epsilon, bounds):
+def sample_D_mild(ctx):
     """
-    update beta, q, g, gamma with independent MCMC sampling
-    each of B, C, D is a list of binomial distributions. The prior is a gamma distribution for each parameter 
-    
-    proposal distribution is univariate gaussian centered at previous value and sigma from rand_walk_stds (there
-    are four; one for each param). 
-
+    get a sample from p(D_mild|B, C, params) using metropolis hastings
     """
-    def fn(x, data):
-        """
-        here x is equal to one of beta, q, g, gamma. since we compute the same likelihood
-        function to update each of the params, it is sufficient to use this generic function
-        instead of writing one fn function for each param.
-
-        other_data['which_param'] stores the parameter to update. it is an index of params
-
-        """
-        beta, q, delta, rho, gamma_mild, gamma_wild, k = x
-        S, E, I_mild, I_wild, P, N = data
-
-        pC = 1 - np.exp(-rho)
-        pR_mild = 1 - np.exp(-gamma_mild)
-        pR_wild = 1 - np.exp(-gamma_wild)
-
-        # log likelihood
-        # add epsilon to avoid log 0.
-        logB = np.sum(np.log(sp.stats.binom(S, P).pmf(B) + epsilon))
-        logC = np.sum(np.log(sp.stats.binom(E, pC).pmf(C) + epsilon))
-        logD_mild = np.sum(np.log(sp.stats.binom(I_mild, pR_mild).pmf(D_mild) + epsilon))
-        logD_wild = np.sum(np.log(sp.stats.binom(I_wild, pR_wild).pmf(D_wild) + epsilon))
-
-        assert not np.isnan(logB)
-        assert not np.isnan(logC)
-        assert not np.isnan(logD_mild)
-        assert not np.isnan(logD_wild)
-
-        # log prior
-        log_prior = 0
-        for i in range(len(priors)):
-            a, b = priors[i]
-            log_prior += np.log(sp.stats.gamma(a, b).pdf(x[i])+epsilon)
-        assert not np.isnan(log_prior)        
-        return logB + logC + logD_mild + logD_wild + log_prior
-
-    def proposal(x, data, conditions_fn):
-        """
-        see docstring for previous function
-        """
-        S, E, I_mild, I_wild, P, N = data
-        n_tries = 0
-        while n_tries < 100:
-            n_tries += 1
-            
-            x_new = np.random.normal(x, rand_walk_stds)
-            beta, q, delta, rho, gamma_mild, gamma_wild, k = x_new
-            
-            factor_indices = np.array(range(len(N)))
-            # factor_old = 1/old_k-old_kctrl*np.log(1+np.exp(factor_indices-t_ctrl))
-            # factor_new = 1/k-kctrl*np.log(1+np.exp(factor_indices-t_ctrl))
-    
-            N_new = round_int(N*old_k / k)
-            N_new[N_new<1] = 1
-            S_new = compute_S(e0, i_mild0, i_wild0, B, N_new)
-            E_new = compute_E(e0, B, C)
-            I_mild_new =compute_I(i_mild0, round_int(C*delta), D_mild)
-            I_wild_new =compute_I(i_wild0, C-round_int(C*delta), D_wild)            
-            P_new = compute_P(transmission_rate(beta, q, t_ctrl, t_end), I_mild_new, I_wild_new, N_new)
-            data_new = [S_new, E_new, I_mild_new, I_wild_new, P_new, N_new]
-
-            if conditions_fn(x_new, data_new):
-                # print(x_new-x, fn(x_new, data_new)-fn(x, data))
-                return x_new, data_new
-        print("sample not found")
-        return x, data
-    
-    def conditions_fn(x, data):
-        """
-        all parameters should be non-negative
-        """
-        beta, q, delta, rho, gamma_mild, gamma_wild, k = x
-        S, E, I_mild, I_wild, P, N = data
-        
-        # if not 1/k-kctrl*np.log(1+np.exp(len(N)-t_ctrl)) > 0:
-        #     return False
-
-        if not (x > 0).all():
-            return False
-        
-        if not (S >= 0).all() or not (E >= 0).all() or not (I_mild >= 0).all() or not (I_wild >= 0).all():
-            return False
-
-        for i in range(len(bounds)):
-            a, b = bounds[i]
-            param = x[i]
-            if x[i] < a or x[i] > b:
-                print("failed here")
-                return False
-        return True
-
-    e0, i_mild0, i_wild0 = inits
-    S, E, I_mild, I_wild, B, C, D_mild, D_wild, P, N = variables
-    t_end = len(N)
-    beta, q, delta, rho, gamma_mild, gamma_wild, k = params
-    old_k = k
-    data = [S, E, I_mild, I_wild, P, N]
-
-    params_new, data, log_prob_new, log_prob_old = metropolis_hastings(np.array(params), data, fn, proposal, conditions_fn, burn_in=1)
-    beta, q, delta, rho, gamma_mild, gamma_wild, k = params_new
-    t_rate = transmission_rate(beta, q, t_ctrl, t_end)
-    # R0t = (sum(D_mild)+sum(D_wild))*t_rate /((sum(D_mild)*gamma_mild+sum(D_wild)*gamma_wild)) * S/N
-    R0t = t_rate /(delta*gamma_mild+(1-delta)*gamma_wild) * S/N
-    
-    S, E, I_mild, I_wild, P, N = data
-    
-    return params_new.tolist(), S, E, I_mild, I_wild, P, N, R0t, log_prob_new, log_prob_old
-
-
-def compute_S(e0, i_mild0, i_wild0, B, N):
+    # C and delta are fixed while sampling D_mild
+    ctx.C_mild = round_int(ctx.C*ctx.delta, out=ctx.buffers['C_mild'])
+    data = [ctx.I_mild]
+    old = {'D_mild': ctx.D_mild, 'I_mild': ctx.I_mild}
+    ctx.D_mild, data, log_prob_new, log_prob_old = metropolis_hastings(ctx.D_mild, data, fn_D_mild, proposal_D_mild, 
+                                                                       conditions_D_mild, ctx)
+    ctx.I_mild = data[0]
+    swap_buffers(ctx.buffers, old, {'D_mild': ctx.D_mild, 'I_mild': ctx.I_mild})
+    P_new = compute_P(ctx.t_rate, ctx.I_mild, ctx.I_wild, ctx.N, out=ctx.buffers['P'])
+    swap_buffers(ctx.buffers, {'P': ctx.P}, {'P': P_new})
+    ctx.P = P_new
+    return log_prob_new, log_prob_old
+
+def fn_params(x, data, ctx):
     """
-    S(0) = s0
-    S(t+1) = S(t) - B(t) + N(t+1)-N(t) for t >= 0
+    here x is equal to one of beta, q, g, gamma. since we compute the same likelihood
+    function to update each of the params, it is sufficient to use this generic function
+    instead of writing one fn function for each param.
 
-    can be simplified to S(t+1) = s0 - sum(B[:t])
-    """
-    return N[0] - np.concatenate(([0], np.cumsum(B)[:-1])) + N - N[0]
+    other_data['which_param'] stores the parameter to update. it is an index of params
 
-def compute_E(e0, B, C):
     """
-    E(0) = e0
-    E(t+1) = E(t) + B(t) - C(t) for t >= 0
+    beta, q, delta, rho, gamma_mild, gamma_wild, k = x
+    S, E, I_mild, I_wild, P, N, t_rate, (pC, pR_mild, pR_wild) = data
+    lgamma_B, coef_C, lgamma_D_mild = ctx.param_coefs
 
-    can be simplified to E(t+1) = e0+sum(B[:t]-C[:t])
-    """
-    return e0 + np.concatenate(([0], np.cumsum(B - C)[:-1]))
+    # log likelihood of B, C, D_mild and D_wild
+    log_lik = param_loglik(S, P, ctx.B, lgamma_B, E, pC, ctx.C, coef_C, I_mild, pR_mild, ctx.D_mild, 
+                           lgamma_D_mild, I_wild, pR_wild, ctx.D_wild, ctx.lgamma_D_wild, ctx.epsilon)
+    assert not np.isnan(log_lik)
 
+    # log prior
+    log_prior = log_gamma_prior(x, ctx.priors[0], ctx.priors[1], ctx.priors[2], ctx.epsilon)
+    assert not np.isnan(log_prior)        
+    return log_lik + log_prior
 
-def compute_I(i0, C, D):
+def proposal_params(x, data, conditions_fn, ctx):
     """
-    computes either I_mild or I_wild depending on the inputs
-    I(0) = i0
-    I(t+1) = I(t) + C(t) - D(t) for t >= 0
-
-    can be simplified to I(t+1) = i0+sum(C[:t]-D[:t])
+    see docstring for previous function
     """
-    return i0 + np.concatenate(([0], np.cumsum(C - D)[:-1]))
-
+    S, E, I_mild, I_wild, P, N, t_rate, probs = data
+    buffers = ctx.buffers
+    # params in ctx are only updated after the MH step
+    old_k = ctx.k
+    n_tries = 0
+    while n_tries < 100:
+        n_tries += 1
+        
+        x_new = ctx.rng.normal(x, ctx.rand_walk_stds)
+        beta, q, delta, rho, gamma_mild, gamma_wild, k = x_new
+        # t_rate only depends on beta and q
+        if x_new[0] != x[0] or x_new[1] != x[1]:
+            t_rate_new = transmission_rate(beta, q, ctx.t_ctrl, ctx.t_end, out=buffers['t_rate'])
+        else:
+            t_rate_new = t_rate
+        pC, pR_mild, pR_wild = probs
+        if rho != x[3]:
+            pC = 1 - np.exp(-rho)
+        if gamma_mild != x[4]:
+            pR_mild = 1 - np.exp(-gamma_mild)
+        if gamma_wild != x[5]:
+            pR_wild = 1 - np.exp(-gamma_wild)
+        
+        # factor_old = 1/old_k-old_kctrl*np.log(1+np.exp(factor_indices-t_ctrl))
+        # factor_new = 1/k-kctrl*np.log(1+np.exp(factor_indices-t_ctrl))
+
+        N_new = round_int(N*old_k / k, out=buffers['N'])
+        np.maximum(N_new, 1, out=N_new)
+        S_new = compute_S(ctx.e0, ctx.i_mild0, ctx.i_wild0, ctx.B, N_new, out=buffers['S'])
+        # E doesn't depend on params
+        E_new = E
+        C_mild = round_int(ctx.C*delta, out=buffers['C_mild'])
+        I_mild_new = compute_I(ctx.i_mild0, C_mild, ctx.D_mild, out=buffers['I_mild'])
+        I_wild_new = compute_I(ctx.i_wild0, ctx.C-C_mild, ctx.D_wild, out=buffers['I_wild'])
+        P_new = compute_P(t_rate_new, I_mild_new, I_wild_new, N_new, out=buffers['P'])
+        data_new = [S_new, E_new, I_mild_new, I_wild_new, P_new, N_new, t_rate_new, (pC, pR_mild, pR_wild)]
+
+        if conditions_fn(x_new, data_new, ctx):
+            # print(x_new-x, fn(x_new, data_new)-fn(x, data))
+            return x_new, data_new
+    print("sample not found")
+    return x, data
 
-def transmission_rate(beta, q, t_ctrl, t_end):
+def conditions_params(x, data, ctx):
+    """
+    all parameters should be non-negative
     """
-    rate of transmission on day t, ie. the number of
-    newly infected individuals on day t.
+    beta, q, delta, rho, gamma_mild, gamma_wild, k = x
+    S, E, I_mild, I_wild, P, N, t_rate, probs = data
     
-    This is defined to be beta prior to t_ctrl and beta*exp(-q(t-t_ctrl)) after t_ctrl
+    # if not 1/k-kctrl*np.log(1+np.exp(len(N)-t_ctrl)) > 0:
+    #     return False
 
-    Note: this is different from R0
-    """
-    trans_rate = np.ones((t_end, )) * beta
-    if t_ctrl < t_end:
-        ctrl_indices = np.array(range(t_ctrl, t_end))
-        trans_rate[ctrl_indices] = beta * np.exp(-q * (ctrl_indices - t_ctrl))
+    if not (x > 0).all():
+        return False
+    
+    if not (S >= 0).all() or not (E >= 0).all() or not (I_mild >= 0).all() or not (I_wild >= 0).all():
+        return False
 
-    assert trans_rate.all() >= 0
-    return trans_rate
+    for i in range(len(ctx.bounds)):
+        a, b = ctx.bounds[i]
+        if x[i] < a or x[i] > b:
+            print("failed here")
+            return False
+    return True
 
-def compute_P(trans_rate, I_mild, I_wild, N):
+def sample_params(ctx):
     """
-    P[t] = 1 - exp(-BETA[t] * I[t] / N)
-    here BETA[t] = time dependent transmission rate
+    update beta, q, g, gamma with independent MCMC sampling
+    each of B, C, D is a list of binomial distributions. The prior is a gamma distribution for each parameter 
+    
+    proposal distribution is univariate gaussian centered at previous value and sigma from rand_walk_stds (there
+    are four; one for each param). 
+
+    returns: R0[t] for the new params and the log probs of the MH step
     """
-    P = 1 - np.exp(-trans_rate * (I_mild+I_wild) / N)
-    return P
+    buffers = ctx.buffers
+    ctx.param_coefs = (lgamma_plus_one(ctx.B, out=buffers['lgamma_B']), 
+                       log_binom_coef(ctx.E, ctx.C, out=buffers['coef_C']), 
+                       lgamma_plus_one(ctx.D_mild, out=buffers['lgamma_D_mild']))
+    data = [ctx.S, ctx.E, ctx.I_mild, ctx.I_wild, ctx.P, ctx.N, ctx.t_rate, (ctx.pC, ctx.pR_mild, ctx.pR_wild)]
+    old = {'S': ctx.S, 'I_mild': ctx.I_mild, 'I_wild': ctx.I_wild, 'P': ctx.P, 'N': ctx.N, 't_rate': ctx.t_rate}
+
+    params_new, data, log_prob_new, log_prob_old = metropolis_hastings(np.array(ctx.params), data, fn_params, 
+                                                                       proposal_params, conditions_params, ctx)
+    beta, q, delta, rho, gamma_mild, gamma_wild, k = params_new
+    t_rate = data[6]
+    # R0t = (sum(D_mild)+sum(D_wild))*t_rate /((sum(D_mild)*gamma_mild+sum(D_wild)*gamma_wild)) * S/N
+    R0t = t_rate /(delta*gamma_mild+(1-delta)*gamma_wild) * ctx.S/ctx.N
+    
+    ctx.set_params(params_new.tolist(), probs=data[7])
+    ctx.S, ctx.E, ctx.I_mild, ctx.I_wild, ctx.P, ctx.N, ctx.t_rate = data[:7]
+    swap_buffers(ctx.buffers, old, {'S': ctx.S, 'I_mild': ctx.I_mild, 'I_wild': ctx.I_wild, 'P': ctx.P, 
+                                    'N': ctx.N, 't_rate': ctx.t_rate})
+    
+    return R0t, log_prob_new, log_prob_old
 
 
 def compute_rand_walk_cov(t, t_skip, C0, C_t, mean_t, mean_tm1, x_t, epsilon):
@@ -557,57 +727,17 @@ def read_dataset(filepath, start, end, n, k):
     return N, round_int(D_wild), df['date'][start_offset: -end_offset]
 
 
-def initialize(inits, params, N, D_wild, t_ctrl, attempt=100):
+def initialize(inits, params, N, D_wild, t_ctrl, rng, attempt=100):
     beta, q, delta, rho, gamma_mild, gamma_wild, k = params
     e0, i_mild0, i_wild0 = inits
-    P, B, C, D_mild, N_new = [], [], [], [], []
-    S, E, I_mild, I_wild = [N[0]], [e0], [i_mild0], [i_wild0] 
+    N = np.array(N)
     t_rate = transmission_rate(beta, q, t_ctrl, len(N))
-    
-    for t in range(len(N)-1):
-        s, e, i_mild, i_wild = S[t], E[t], I_mild[t], I_wild[t]
-        # print(i_mild, i_wild)
-        p = 1-np.exp(-t_rate[t]*(i_mild+i_wild)/N[t])
-        assert 0 <= p <=1
-        
-        d_wild = int(D_wild[t])
-        b = round_int(s*p)
-        c = round_int(e*(1-np.exp(-rho)))
-        d_mild = round_int(i_mild*(1-np.exp(-gamma_mild)))
-
-        c_mild = round_int(c*delta)
-        c_wild = c-c_mild
-        
-        # b <= s cause binom dist, so s >= 0
-        s = s - b + N[t+1] - N[t]
-        e = e + b - c
-        i_mild = i_mild + c_mild - d_mild
-        i_wild = i_wild + c_wild - d_wild
-        print(f"t: {t}, S[t]{s} E[t]:{e} I_mild[t]: {i_mild} I_wild[t]: {i_wild}")
-        assert i_wild >= 0
-        S.append(s)
-        E.append(e)
-        I_mild.append(i_mild)
-        I_wild.append(i_wild)
-        
-        B.append(b)
-        C.append(c)
-        D_mild.append(d_mild)
-        P.append(p)
-
+    S, E, I_mild, I_wild, B, C, D_mild, P = initialize_states(e0, i_mild0, i_wild0, delta, rho, gamma_mild, 
+                                                              N, D_wild, t_rate)
     # last step
-    p = 1-np.exp(-t_rate[-1]*(I_mild[-1]+I_wild[-1])/N[-1])
-    b = np.random.binomial(S[-1], p)
-    d_mild = int(I_mild[-1]*(1-np.exp(-gamma_mild)))
-    c = round_int(E[-1]*(1-np.exp(-rho)))
+    B[-1] = rng.binomial(S[-1], P[-1])
 
-    B.append(b)
-    C.append(c)
-    P.append(p)
-    D_mild.append(d_mild)
-
-    return [np.array(S), np.array(E), np.array(I_mild), np.array(I_wild), 
-            np.array(B), np.array(C), np.array(D_mild), np.array(P), t_rate, np.array(N)]
+    return [S, E, I_mild, I_wild, B, C, D_mild, P, t_rate, N]
 
     # params = [2, 0.05, 0.6, 0.15, 0.33, 0.2] # korea
     
@@ -725,6 +855,8 @@ def parse_arguments():
     parser.add_argument('--save_freq', type=int, default=5, nargs='?', help="how often to save samples after burn in")
     parser.add_argument('--rand_walk_stds', type=str, default="0.001, 0.001, 0.001, 0.001, 0.001, 0.001, 0.001", nargs='?', 
                        help="stds for gaussian random walk in MCMC (one for each param)")
+    parser.add_argument('--n_chains', type=int, default=1, nargs='?', help="number of MCMC chains to run in parallel")
+    parser.add_argument('--seed', type=int, default=None, nargs='?', help="random seed")
 
     # beta, q, delta, rho, gamma_mild, gamma_wild, k
     args = parser.parse_args()
@@ -758,9 +890,16 @@ if __name__ == '__main__':
     save_freq = args.save_freq
     
     
-    params_mean, params_std, R0_conf, R0ts = train(N, D_wild, inits, params, priors, 
-                                                        rand_walk_stds, t_ctrl, tau, n_iter, n_burn_in, bounds, save_freq
-                                                       )[1:]
+    if args.n_chains > 1:
+        params_mean, params_std, R0_conf, R0ts, R_hat = train_parallel(args.n_chains, N, D_wild, inits, params, priors, 
+                                                        rand_walk_stds, t_ctrl, tau, n_iter, n_burn_in, bounds, save_freq,
+                                                        args.seed)[1:]
+        if R_hat is not None:
+            print(f"Gelman-Rubin R_hat (beta, q, delta, rho, gamma_mild, gamma_wild, k): {R_hat}")
+    else:
+        params_mean, params_std, R0_conf, R0ts = train(N, D_wild, inits, params, priors, 
+                                                        rand_walk_stds, t_ctrl, tau, n_iter, n_burn_in, bounds, save_freq,
+                                                        args.seed)[1:]
     print(f"\nFINAL RESULTS\n\ninput file: {in_filename}")
     print(f"ouput file: {out_filename}")
     print(f"param inits: {params}")
@@ -247,8 +247,7 @@ def sample_C(C, variables, inits, params, t_ctrl, epsilon):
 
     def fn(x, data):
         S, I_mild, I_wild, P = data
-        # add epsilon to prevent log 0.
-        return np.sum(np.log(sp.stats.binom(S, P).pmf(x)+epsilon))
+        return floored_binom_loglik(x, S, P, epsilon)
 
 
     def proposal(x, data, conditions_fn):
@@ -289,11 +288,10 @@ def sample_D_mild(D_mild, variables, inits, params, t_ctrl, epsilon):
         I_mild = data[0]
         # assert (S >= x).all()
         # assert (x >= 0).all()
-        # add epsilon to prevent log 0.
         pR = 1-np.exp(-gamma_mild)
         assert 0 <= pR <= 1
         assert not np.isnan(pR)
-        return np.sum(np.log(sp.stats.binom(I_mild, pR).pmf(x)+epsilon))
+        return floored_binom_loglik(x, I_mild, pR, epsilon)
         
 
     def proposal(x, data, conditions_fn):
@@ -344,11 +342,10 @@ def sample_params(params, variables, inits, priors, rand_walk_stds, t_ctrl, epsi
         pR_wild = 1 - np.exp(-gamma_wild)
 
         # log likelihood
-        # add epsilon to avoid log 0.
-        logC = np.sum(np.log(sp.stats.binom(S, P).pmf(C) + epsilon))
+        logC = floored_binom_loglik(C, S, P, epsilon)
 
-        logD_mild = np.sum(np.log(sp.stats.binom(I_mild, pR_mild).pmf(D_mild) + epsilon))
-        logD_wild = np.sum(np.log(sp.stats.binom(I_wild, pR_wild).pmf(D_wild) + epsilon))
+        logD_mild = floored_binom_loglik(D_mild, I_mild, pR_mild, epsilon)
+        logD_wild = floored_binom_loglik(D_wild, I_wild, pR_wild, epsilon)
 
         assert not np.isnan(logC)
         assert not np.isnan(logD_mild)
@@ -358,7 +355,7 @@ def sample_params(params, variables, inits, priors, rand_walk_stds, t_ctrl, epsi
         log_prior = 0
         for i in range(len(priors)):
             a, b = priors[i]
-            log_prior += np.log(sp.stats.gamma(a, b).pdf(x[i])+epsilon)
+            log_prior += np.log(sp.stats.gamma.pdf(x[i], a, b)+epsilon)
         assert not np.isnan(log_prior)        
         return logC + logD_mild + logD_wild + log_prior
 
@@ -434,7 +431,13 @@ def compute_S(C, N, inits):
     can be simplified to S(t+1) = s0 - sum(B[:t])
     """
     imild0, iwild0 = inits
-    return N[0] - imild0 - iwild0 - np.concatenate(([0], np.cumsum(C)[:-1])) + N - N[0]
+    out = np.empty(len(C), dtype=np.result_type(N, C, imild0, iwild0))
+    # S = N[0] - imild0 - iwild0 - sum(C[:t]) + N - N[0] = N - sum(C[:t]) - imild0 - iwild0
+    out[0] = 0
+    np.cumsum(C[:-1], out=out[1:])
+    np.subtract(N, out, out=out)
+    out -= imild0 + iwild0
+    return out
 
 
 def compute_I(i0, C, D):
@@ -445,7 +448,12 @@ def compute_I(i0, C, D):
 
     can be simplified to I(t+1) = i0+sum(C[:t]-D[:t])
     """
-    return i0 + np.concatenate(([0], np.cumsum(C - D)[:-1]))
+    out = np.empty(len(C), dtype=np.result_type(i0, C, D))
+    out[0] = 0
+    np.subtract(C[:-1], D[:-1], out=out[1:])
+    np.cumsum(out[1:], out=out[1:])
+    out += i0
+    return out
 
 
 def transmission_rate(beta, q, t_ctrl, t_end):
@@ -474,6 +482,16 @@ def compute_P(trans_rate, I_mild, I_wild, N):
     return P
 
 
+def floored_binom_loglik(k, n, p, epsilon):
+    """
+    sum of log(Binom(k; n, p) + epsilon)
+
+    the pmf is floored at epsilon to prevent log 0, so impossible k keep a
+    finite log likelihood. logaddexp(logpmf, log(epsilon)) = log(pmf + epsilon)
+    """
+    return np.sum(np.logaddexp(sp.stats.binom.logpmf(k, n, p), np.log(epsilon)))
+
+
 def compute_rand_walk_cov(t, t_skip, C0, C_t, mean_t, mean_tm1, x_t, epsilon):
     assert t_skip > 2
     if t < t_skip: